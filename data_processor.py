@@ -4,151 +4,284 @@ Data Agent v5.0 - 数据处理模块
 处理第1章数据链
 """
 
+import copy
 import json
+import re
 import sqlite3
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
 
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+try:
+    import ahocorasick
+    HAS_AHOCORASICK = True
+except ImportError:
+    HAS_AHOCORASICK = False
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
 PROJECT_ROOT = Path("/root/xiaoshuo")
 STORAGE_PATH = PROJECT_ROOT / ".webnovel"
 STATE_FILE = STORAGE_PATH / "state.json"
 INDEX_DB = STORAGE_PATH / "index.db"
 VECTORS_DB = STORAGE_PATH / "vectors.db"
 
+# index.db 中以 JSON TEXT 存储的列表列（与 IndexManager / status_reporter 共用，
+# 读取方均用 json.loads 解析）；旧库缺失时由 _add_json_columns 补齐
+JSON_COLUMNS = {
+    'chapters': ('characters', 'scenes'),
+    'entity_appearances': ('mentions',),
+    'scenes': ('characters',),
+}
+
+# index.db 连接参数：WAL + NORMAL 同步，减少小事务的 fsync 开销；
+# 章节行总在同一事务内先于出场记录写入，显式关闭外键校验
+INDEX_PRAGMAS = (
+    'PRAGMA foreign_keys=OFF',
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA mmap_size=268435456',
+)
+
+# extract_entities 规则表：(输出类别, 触发条件, 输出记录)
+# 触发条件为若干关键词组，任一组关键词全部命中即触发；空组表示无条件触发
+ENTITY_RULES = (
+    # 1. 识别核心角色 - 叶凡
+    ('appeared', (('叶凡',),), ({
+        'id': 'yefan',
+        'type': '角色',
+        'mentions': ['叶凡', '他'],
+        'confidence': 0.95
+    },)),
+    # 2. 识别核心角色 - 顾晚晴
+    ('appeared', (('顾晚晴',),), ({
+        'id': 'guwanqing',
+        'type': '角色',
+        'mentions': ['顾晚晴', '她', '顾女士'],
+        'confidence': 0.95
+    },)),
+    # 3. 新实体识别 - 中年妇女（房东中介）
+    ('new', (('中年妇女', '房东直租'),), ({
+        'suggested_id': 'middle_woman',
+        'name': '中年妇女',
+        'type': '角色',
+        'tier': '装饰',
+        'desc': '街边举牌招租的中年妇女，态度敷衍'
+    },)),
+    # 4. 地点识别 - 静雅小区
+    ('new', (('静雅小区',),), ({
+        'suggested_id': 'jingya_community',
+        'name': '静雅小区',
+        'type': '地点',
+        'tier': '重要',
+        'desc': '老小区，干净整洁，有3号楼602室'
+    },)),
+    # 5. 地点识别 - 3号楼602室
+    ('new', (('602室',), ('3号楼',)), ({
+        'suggested_id': '602_room',
+        'name': '602室',
+        'type': '地点',
+        'tier': '重要',
+        'desc': '顾晚晴的出租房次卧'
+    },)),
+    # 6. 状态变化 - 叶凡租房成功
+    ('state_change', (('租房', '加微信'),), ({
+        'entity_id': 'yefan',
+        'field': 'location',
+        'old': '无处可去',
+        'new': '静雅小区3号楼602室',
+        'reason': '租房成功'
+    }, {
+        'entity_id': 'yefan',
+        'field': 'status',
+        'old': '找工作',
+        'new': '租房中',
+        'reason': '成为租客'
+    })),
+    # 7. 状态变化 - 顾晚晴的房产状态
+    ('state_change', (('租出去',), ('还房贷',)), ({
+        'entity_id': 'guwanqing',
+        'field': 'location',
+        'old': '顾晚晴的房产',
+        'new': '静雅小区3号楼602室(房产)',
+        'reason': '房子出租给叶凡'
+    },)),
+    # 8. 关系建立 - 房东与租客
+    ('relationship', ((),), ({
+        'from': 'yefan',
+        'to': 'guwanqing',
+        'type': '房东-租客',
+        'description': '叶凡租住顾晚晴的房子'
+    },)),
+    # 9. 不确定项
+    ('uncertain', ((),), ({
+        'mention': '那位先生',
+        'context': '中年妇女对叶凡的称呼',
+        'candidates': [{'type': '角色', 'id': 'yefan'}],
+        'confidence': 0.85
+    },)),
+)
+
+# 预编译触发条件为 frozenset，命中判断即子集检查
+_COMPILED_RULES = tuple(
+    (category, tuple(frozenset(group) for group in triggers), records)
+    for category, triggers, records in ENTITY_RULES
+)
+
+# 规则用到的全部关键词（去重保序，单次多模式扫描）
+CHAPTER_KEYWORDS = tuple(dict.fromkeys(
+    keyword for _, triggers, _ in ENTITY_RULES for group in triggers for keyword in group
+))
+
+def _dumps_json(obj, newline=False):
+    """
+    序列化为紧凑 UTF-8 JSON 字节（优先 orjson，不可用时回退标准库）
+    newline=True 时在编码阶段直接追加末尾换行，避免再拼接一次字节串
+    """
+    if HAS_ORJSON:
+        option = orjson.OPT_NON_STR_KEYS
+        if newline:
+            option |= orjson.OPT_APPEND_NEWLINE
+        return orjson.dumps(obj, option=option)
+    data = json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+    return (data + '\n' if newline else data).encode('utf-8')
+
+
+def _loads_json(data):
+    """解析 JSON 字节/字符串"""
+    if HAS_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _encode(obj):
+    """编码列表列为 JSON TEXT"""
+    return _dumps_json(obj).decode('utf-8')
+
+
+def _build_keyword_automaton(keywords):
+    """构建 Aho-Corasick 自动机（pyahocorasick 不可用时返回 None）"""
+    if not HAS_AHOCORASICK:
+        return None
+    automaton = ahocorasick.Automaton()
+    for index, keyword in enumerate(keywords):
+        automaton.add_word(keyword, (index, keyword))
+    automaton.make_automaton()
+    return automaton
+
+
+KEYWORD_AUTOMATON = _build_keyword_automaton(CHAPTER_KEYWORDS)
+
+
+def scan_keywords(chapter_content):
+    """扫描正文一次，返回命中的关键词集合"""
+    if KEYWORD_AUTOMATON is not None:
+        return {keyword for _, (_, keyword) in KEYWORD_AUTOMATON.iter(chapter_content)}
+    return {keyword for keyword in CHAPTER_KEYWORDS if keyword in chapter_content}
+
+
+def iter_keyword_hits(chapter_content):
+    """逐个产出关键词命中 (起始偏移, 关键词序号)；两条路径均计入重叠命中"""
+    if KEYWORD_AUTOMATON is not None:
+        for end, (index, keyword) in KEYWORD_AUTOMATON.iter(chapter_content):
+            yield end - len(keyword) + 1, index
+        return
+    for index, keyword in enumerate(CHAPTER_KEYWORDS):
+        start = chapter_content.find(keyword)
+        while start != -1:
+            yield start, index
+            start = chapter_content.find(keyword, start + 1)
+
+
+def count_scene_mentions(chapter_content, scenes):
+    """
+    统计每个场景内各关键词的出现次数
+    scenes 需按行号升序排列；返回 len(scenes) × len(CHAPTER_KEYWORDS) 的计数表
+    """
+    n_scenes, n_terms = len(scenes), len(CHAPTER_KEYWORDS)
+    newlines = [m.start() for m in re.finditer('\n', chapter_content)]
+    hits = list(iter_keyword_hits(chapter_content))
+
+    if HAS_NUMPY:
+        # 偏移 -> 行号 -> 场景序号，再用 bincount 一次性汇总
+        offsets = np.fromiter((offset for offset, _ in hits), dtype=np.int64, count=len(hits))
+        term_ids = np.fromiter((term for _, term in hits), dtype=np.int64, count=len(hits))
+        start_lines = np.array([scene['start_line'] for scene in scenes], dtype=np.int64)
+        end_lines = np.array([scene['end_line'] for scene in scenes], dtype=np.int64)
+
+        line_no = np.searchsorted(np.asarray(newlines, dtype=np.int64), offsets) + 1
+        scene_idx = np.searchsorted(end_lines, line_no)
+        valid = scene_idx < n_scenes
+        valid[valid] = line_no[valid] >= start_lines[scene_idx[valid]]
+
+        counts = np.bincount(
+            scene_idx[valid] * n_terms + term_ids[valid], minlength=n_scenes * n_terms
+        ).reshape(n_scenes, n_terms)
+        return counts.tolist()
+
+    end_lines = [scene['end_line'] for scene in scenes]
+    counts = [[0] * n_terms for _ in scenes]
+    for offset, term in hits:
+        line_no = bisect_left(newlines, offset) + 1
+        idx = bisect_left(end_lines, line_no)
+        if idx < n_scenes and line_no >= scenes[idx]['start_line']:
+            counts[idx][term] += 1
+    return counts
+
+
 # ========== Step A: 加载上下文 ==========
 def load_context():
     """加载已有实体库和上下文"""
-    with open(STATE_FILE, 'r', encoding='utf-8') as f:
-        state = json.load(f)
+    with open(STATE_FILE, 'rb') as f:
+        state = _loads_json(f.read())
 
     entities = state.get('entities_v3', {})
     alias_index = state.get('alias_index', {})
 
     # 构建别名到实体的映射
-    alias_to_entities = {}
+    alias_to_entities = defaultdict(list)
     for alias, mappings in alias_index.items():
-        for m in mappings:
-            entity_id = m['id']
-            entity_type = m['type']
-            if alias not in alias_to_entities:
-                alias_to_entities[alias] = []
-            alias_to_entities[alias].append({'id': entity_id, 'type': entity_type})
+        alias_to_entities[alias].extend({'id': m['id'], 'type': m['type']} for m in mappings)
 
-    return state, entities, alias_to_entities
+    return state, entities, dict(alias_to_entities)
 
 # ========== Step B: AI 实体提取 ==========
 def extract_entities(chapter_content, existing_entities, alias_to_entities):
     """
-    基于章节内容提取实体信息
+    基于章节内容提取实体信息（按 ENTITY_RULES 表驱动）
     返回: entities_appeared, entities_new, state_changes, relationships_new, uncertain
     """
-    entities_appeared = []
-    entities_new = []
-    state_changes = []
-    relationships_new = []
-    uncertain = []
-
-    # 已知实体识别
-    known_roles = existing_entities.get('角色', {})
-    known_locations = existing_entities.get('地点', {})
-
-    # 已出场的实体ID
-    appeared_ids = set()
-
-    # 1. 识别核心角色 - 叶凡
-    if '叶凡' in chapter_content:
-        entities_appeared.append({
-            'id': 'yefan',
-            'type': '角色',
-            'mentions': ['叶凡', '他'],
-            'confidence': 0.95
-        })
-        appeared_ids.add('yefan')
-
-    # 2. 识别核心角色 - 顾晚晴
-    if '顾晚晴' in chapter_content:
-        entities_appeared.append({
-            'id': 'guwanqing',
-            'type': '角色',
-            'mentions': ['顾晚晴', '她', '顾女士'],
-            'confidence': 0.95
-        })
-        appeared_ids.add('guwanqing')
-
-    # 3. 新实体识别 - 中年妇女（房东中介）
-    if '中年妇女' in chapter_content and '房东直租' in chapter_content:
-        entities_new.append({
-            'suggested_id': 'middle_woman',
-            'name': '中年妇女',
-            'type': '角色',
-            'tier': '装饰',
-            'desc': '街边举牌招租的中年妇女，态度敷衍'
-        })
-
-    # 4. 地点识别 - 静雅小区
-    if '静雅小区' in chapter_content:
-        entities_new.append({
-            'suggested_id': 'jingya_community',
-            'name': '静雅小区',
-            'type': '地点',
-            'tier': '重要',
-            'desc': '老小区，干净整洁，有3号楼602室'
-        })
-
-    # 5. 地点识别 - 3号楼602室
-    if '602室' in chapter_content or '3号楼' in chapter_content:
-        entities_new.append({
-            'suggested_id': '602_room',
-            'name': '602室',
-            'type': '地点',
-            'tier': '重要',
-            'desc': '顾晚晴的出租房次卧'
-        })
-
-    # 6. 状态变化 - 叶凡租房成功
-    if '租房' in chapter_content and '加微信' in chapter_content:
-        state_changes.append({
-            'entity_id': 'yefan',
-            'field': 'location',
-            'old': '无处可去',
-            'new': '静雅小区3号楼602室',
-            'reason': '租房成功'
-        })
-        state_changes.append({
-            'entity_id': 'yefan',
-            'field': 'status',
-            'old': '找工作',
-            'new': '租房中',
-            'reason': '成为租客'
-        })
-
-    # 7. 状态变化 - 顾晚晴的房产状态
-    if '租出去' in chapter_content or '还房贷' in chapter_content:
-        state_changes.append({
-            'entity_id': 'guwanqing',
-            'field': 'location',
-            'old': '顾晚晴的房产',
-            'new': '静雅小区3号楼602室(房产)',
-            'reason': '房子出租给叶凡'
-        })
+    outputs = {
+        'appeared': [],
+        'new': [],
+        'state_change': [],
+        'relationship': [],
+        'uncertain': [],
+    }
 
-    # 8. 关系建立 - 房东与租客
-    relationships_new.append({
-        'from': 'yefan',
-        'to': 'guwanqing',
-        'type': '房东-租客',
-        'description': '叶凡租住顾晚晴的房子'
-    })
+    # 关键词命中集合（一次扫描，后续规则均为集合查询）
+    hits = scan_keywords(chapter_content)
 
-    # 9. 不确定项
-    uncertain.append({
-        'mention': '那位先生',
-        'context': '中年妇女对叶凡的称呼',
-        'candidates': [{'type': '角色', 'id': 'yefan'}],
-        'confidence': 0.85
-    })
+    for category, triggers, records in _COMPILED_RULES:
+        if any(group <= hits for group in triggers):
+            outputs[category].extend(copy.deepcopy(records))
 
-    return entities_appeared, entities_new, state_changes, relationships_new, uncertain
+    return (outputs['appeared'], outputs['new'], outputs['state_change'],
+            outputs['relationship'], outputs['uncertain'])
 
 # ========== Step C: 实体消歧处理 ==========
 def disambiguate(uncertain):
@@ -179,10 +312,16 @@ def disambiguate(uncertain):
     return adopted, warnings
 
 # ========== Step D: 写入存储 - 更新 state.json ==========
-def update_state(state, entities_appeared, entities_new, state_changes, relationships_new):
+def update_state(state, entities_appeared, entities_new, state_changes, relationships_new, now_iso):
     """更新 state.json 文件"""
     entities_v3 = state.get('entities_v3', {})
-    alias_index = state.get('alias_index', {})
+    alias_index = defaultdict(list, state.get('alias_index', {}))
+
+    # 实体ID -> 类型反查表（同名ID取首个类型，与逐类型查找一致）
+    id_to_type = {}
+    for entity_type, bucket in entities_v3.items():
+        for entity_id in bucket:
+            id_to_type.setdefault(entity_id, entity_type)
 
     # 添加新实体
     for new_entity in entities_new:
@@ -209,10 +348,9 @@ def update_state(state, entities_appeared, entities_new, state_changes, relation
             'created_chapter': 1,
             'first_appearance': '正文/第0001章.md'
         }
+        id_to_type.setdefault(entity_id, entity_type)
 
         # 更新别名索引
-        if name not in alias_index:
-            alias_index[name] = []
         alias_index[name].append({'type': entity_type, 'id': entity_id})
 
     # 更新状态变化
@@ -222,130 +360,230 @@ def update_state(state, entities_appeared, entities_new, state_changes, relation
         new_value = change['new']
 
         # 查找实体
-        found = False
-        for entity_type in entities_v3:
-            if entity_id in entities_v3[entity_type]:
-                entity = entities_v3[entity_type][entity_id]
-                old_value = entity['current'].get(field, '')
-                entity['current'][field] = new_value
-                entity['current']['last_chapter'] = 1
-
-                # 记录历史
-                entity['history'].append({
-                    'chapter': 1,
-                    'field': field,
-                    'old': old_value,
-                    'new': new_value,
-                    'reason': change.get('reason', '')
-                })
-                found = True
-                break
-
-    # 添加关系
-    if 'relationships' not in state:
-        state['relationships'] = []
+        entity_type = id_to_type.get(entity_id)
+        if entity_type is None:
+            continue
+
+        entity = entities_v3[entity_type][entity_id]
+        old_value = entity['current'].get(field, '')
+        entity['current'][field] = new_value
+        entity['current']['last_chapter'] = 1
+
+        # 记录历史
+        entity['history'].append({
+            'chapter': 1,
+            'field': field,
+            'old': old_value,
+            'new': new_value,
+            'reason': change.get('reason', '')
+        })
+
+    # 添加关系（state_manager 将旧版 list 折叠进 structured_relationships，
+    # 之后 relationships 为人物关系 dict，新关系直接追加到 structured_relationships）
+    relationships = state.setdefault('relationships', [])
+    if isinstance(relationships, dict):
+        relationships = state.setdefault('structured_relationships', [])
 
     for rel in relationships_new:
-        state['relationships'].append({
+        relationships.append({
             'from': rel['from'],
             'to': rel['to'],
             'type': rel['type'],
             'description': rel['description'],
             'chapter': 1,
-            'created_at': datetime.now().isoformat()
+            'created_at': now_iso
         })
 
     # 更新元数据
     state['entities_v3'] = entities_v3
-    state['alias_index'] = alias_index
+    state['alias_index'] = dict(alias_index)
     state['metadata']['current_chapter'] = 1
-    state['metadata']['updated_at'] = datetime.now().isoformat()
+    state['metadata']['updated_at'] = now_iso
 
     # 写入文件
-    with open(STATE_FILE, 'w', encoding='utf-8') as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
+    with open(STATE_FILE, 'wb') as f:
+        f.write(_dumps_json(state))
 
     return state
 
 # ========== Step D续: 创建 index.db ==========
-def create_index_db():
-    """创建或更新 index.db"""
-    conn = sqlite3.connect(str(INDEX_DB))
-    cursor = conn.cursor()
-
-    # 创建章节表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS chapters (
-            chapter INTEGER PRIMARY KEY,
-            title TEXT,
-            location TEXT,
-            word_count INTEGER,
-            characters TEXT,
-            scenes TEXT,
-            created_at TEXT
-        )
-    ''')
-
-    # 创建实体出场表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS entity_appearances (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chapter INTEGER,
-            entity_id TEXT,
-            entity_type TEXT,
-            mentions TEXT,
-            confidence REAL,
-            FOREIGN KEY (chapter) REFERENCES chapters(chapter)
-        )
-    ''')
-
-    # 创建场景表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS scenes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chapter INTEGER,
-            scene_index INTEGER,
-            location TEXT,
-            summary TEXT,
-            characters TEXT,
-            start_line INTEGER,
-            end_line INTEGER
-        )
-    ''')
-
-    conn.commit()
-    conn.close()
-
-def insert_chapter_data(chapter, title, location, word_count, entities_appeared, scenes):
-    """插入章节数据"""
-    conn = sqlite3.connect(str(INDEX_DB))
-    cursor = conn.cursor()
-
-    characters = json.dumps([e['id'] for e in entities_appeared])
-    scenes_json = json.dumps(scenes)
-
-    cursor.execute('''
+def _open_index():
+    """打开 index.db（autocommit 模式，事务由 _transaction 显式控制）"""
+    conn = sqlite3.connect(str(INDEX_DB), isolation_level=None)
+    for pragma in INDEX_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+@contextmanager
+def _transaction(conn):
+    """BEGIN IMMEDIATE ... COMMIT，异常时回滚"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn.cursor()
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+def _add_json_columns(cursor):
+    """补齐旧版 index.db 缺失的列表列（如早期 chapters 表没有 characters / scenes）"""
+    for table, columns in JSON_COLUMNS.items():
+        declared = {row[1] for row in cursor.execute(f'PRAGMA table_info({table})')}
+        for column in columns:
+            if column not in declared:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} TEXT')
+
+class IndexStore:
+    """index.db 长连接存储（一次打开，多章节复用）"""
+
+    INSERT_CHAPTER_SQL = '''
         INSERT OR REPLACE INTO chapters (chapter, title, location, word_count, characters, scenes, created_at)
         VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (chapter, title, location, word_count, characters, scenes_json, datetime.now().isoformat()))
-
-    # 插入实体出场记录
-    for entity in entities_appeared:
-        cursor.execute('''
-            INSERT INTO entity_appearances (chapter, entity_id, entity_type, mentions, confidence)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (chapter, entity['id'], entity['type'], json.dumps(entity['mentions']), entity['confidence']))
-
-    # 插入场景数据
-    for scene in scenes:
-        cursor.execute('''
-            INSERT INTO scenes (chapter, scene_index, location, summary, characters, start_line, end_line)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (chapter, scene['index'], scene['location'], scene['summary'],
-              json.dumps(scene['characters']), scene['start_line'], scene['end_line']))
-
-    conn.commit()
-    conn.close()
+    '''
+    INSERT_APPEARANCE_SQL = '''
+        INSERT INTO entity_appearances (chapter, entity_id, entity_type, mentions, confidence)
+        VALUES (?, ?, ?, ?, ?)
+    '''
+    INSERT_SCENE_SQL = '''
+        INSERT INTO scenes (chapter, scene_index, location, summary, characters, start_line, end_line)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    '''
+    # 与 StructuredIndex.sync_relationships_from_state 相同的去重写入
+    UPSERT_RELATIONSHIP_SQL = '''
+        INSERT OR REPLACE INTO relationships
+        (id, char1_id, char2_id, char1_name, char2_name, relation_type, intensity, description, last_update_chapter, updated_at)
+        VALUES (
+            (SELECT id FROM relationships WHERE char1_id = ? AND char2_id = ? AND relation_type = ?),
+            ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP
+        )
+    '''
+
+    def __init__(self):
+        self.conn = _open_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """关闭连接（关闭前 PRAGMA optimize，仅在统计信息过期时重新分析）"""
+        if self.conn is not None:
+            self.conn.execute('PRAGMA optimize')
+            self.conn.close()
+            self.conn = None
+
+    def create(self):
+        """创建或更新 index.db 表结构"""
+        with _transaction(self.conn) as cursor:
+            # 创建章节表
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS chapters (
+                    chapter INTEGER PRIMARY KEY,
+                    title TEXT,
+                    location TEXT,
+                    word_count INTEGER,
+                    characters TEXT,
+                    scenes TEXT,
+                    created_at TEXT
+                )
+            ''')
+
+            # 创建实体出场表
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS entity_appearances (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chapter INTEGER,
+                    entity_id TEXT,
+                    entity_type TEXT,
+                    mentions TEXT,
+                    confidence REAL
+                )
+            ''')
+
+            # 创建场景表
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS scenes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chapter INTEGER,
+                    scene_index INTEGER,
+                    location TEXT,
+                    summary TEXT,
+                    characters TEXT,
+                    start_line INTEGER,
+                    end_line INTEGER
+                )
+            ''')
+
+            # 创建关系表（与 structured_index.py 共用，表结构须保持一致）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS relationships (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    char1_id TEXT,
+                    char2_id TEXT,
+                    char1_name TEXT,
+                    char2_name TEXT,
+                    relation_type TEXT,
+                    intensity INTEGER,
+                    description TEXT,
+                    last_update_chapter INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(char1_id, char2_id, relation_type)
+                )
+            ''')
+
+            # 创建索引
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_ea_chapter_entity ON entity_appearances(chapter, entity_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_scenes_chapter ON scenes(chapter)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_char1_char2 ON relationships(char1_id, char2_id)")
+
+            _add_json_columns(cursor)
+
+    def insert_chapter(self, chapter, title, location, word_count, entities_appeared, scenes, now_iso):
+        """插入章节数据（单事务批量写入）"""
+        characters = _encode([e['id'] for e in entities_appeared])
+        scenes_json = _encode(scenes)
+
+        appearance_rows = [
+            (chapter, e['id'], e['type'], _encode(e['mentions']), e['confidence'])
+            for e in entities_appeared
+        ]
+        scene_rows = [
+            (chapter, s['index'], s['location'], s['summary'],
+             _encode(s['characters']), s['start_line'], s['end_line'])
+            for s in scenes
+        ]
+
+        with _transaction(self.conn) as cursor:
+            cursor.execute(self.INSERT_CHAPTER_SQL, (
+                chapter, title, location, word_count, characters, scenes_json, now_iso
+            ))
+
+            # 插入实体出场记录
+            cursor.executemany(self.INSERT_APPEARANCE_SQL, appearance_rows)
+
+            # 插入场景数据
+            cursor.executemany(self.INSERT_SCENE_SQL, scene_rows)
+
+    def upsert_relationships(self, chapter, relationships_new, entities):
+        """写入本章新关系，(char1_id, char2_id, relation_type) 相同时覆盖"""
+        names = {
+            entity_id: entity.get('canonical_name') or entity_id
+            for bucket in entities.values()
+            for entity_id, entity in bucket.items()
+        }
+        rows = []
+        for rel in relationships_new:
+            char1_id, char2_id, rel_type = rel['from'], rel['to'], rel['type']
+            rows.append((
+                char1_id, char2_id, rel_type,  # 子查询定位已有行
+                char1_id, char2_id, names.get(char1_id, char1_id), names.get(char2_id, char2_id),
+                rel_type, rel.get('intensity', 50), rel['description'], chapter
+            ))
+        with _transaction(self.conn) as cursor:
+            cursor.executemany(self.UPSERT_RELATIONSHIP_SQL, rows)
 
 # ========== Step E: 场景切片 ==========
 def chunk_scenes(chapter_content):
@@ -424,8 +662,8 @@ def evaluate_style_sample(review_score, chapter_content):
 
 # ========== Step H: 生成处理报告 ==========
 def generate_report(chapter, entities_appeared, entities_new, state_changes,
-                   relationships_new, scenes, uncertain, warnings, adopted):
-    """生成最终处理报告"""
+                   relationships_new, scenes, uncertain, warnings, adopted, now_iso):
+    """生成最终处理报告（details 直接引用各明细列表，写出时只编码一次）"""
     report = {
         'chapter': chapter,
         'entities_appeared': len(entities_appeared),
@@ -444,7 +682,7 @@ def generate_report(chapter, entities_appeared, entities_new, state_changes,
             'uncertain': uncertain,
             'adopted': adopted
         },
-        'processed_at': datetime.now().isoformat()
+        'processed_at': now_iso
     }
 
     return report
@@ -455,6 +693,9 @@ def main():
     print("Data Agent v5.0 - 第1章数据处理")
     print("=" * 50)
 
+    # 整个流程共用同一处理时间戳
+    now_iso = datetime.now().isoformat()
+
     # 读取章节正文
     chapter_file = PROJECT_ROOT / "正文/第0001章.md"
     with open(chapter_file, 'r', encoding='utf-8') as f:
@@ -487,13 +728,15 @@ def main():
 
     # 更新 state.json
     print("  - 更新 state.json...")
-    update_state(state, entities_appeared, entities_new, state_changes, relationships_new)
+    update_state(state, entities_appeared, entities_new, state_changes, relationships_new, now_iso)
 
     # 创建并更新 index.db
     print("  - 更新 index.db...")
-    create_index_db()
     scenes = chunk_scenes(chapter_content)
-    insert_chapter_data(1, "租房", "静雅小区", 4500, entities_appeared, scenes)
+    with IndexStore() as store:
+        store.create()
+        store.insert_chapter(1, "租房", "静雅小区", 4500, entities_appeared, scenes, now_iso)
+        store.upsert_relationships(1, relationships_new, existing_entities)
 
     # Step E: 场景切片已完成 (在 D 中)
     print(f"\n[Step E] 场景切片: {len(scenes)} 个场景")
@@ -511,13 +754,13 @@ def main():
     print("\n[Step H] 生成处理报告...")
     report = generate_report(
         1, entities_appeared, entities_new, state_changes,
-        relationships_new, scenes, uncertain, warnings, adopted
+        relationships_new, scenes, uncertain, warnings, adopted, now_iso
     )
 
     # 保存报告
     report_file = STORAGE_PATH / f"report_chapter_1.json"
-    with open(report_file, 'w', encoding='utf-8') as f:
-        json.dump(report, f, ensure_ascii=False, indent=2)
+    with open(report_file, 'wb') as f:
+        f.write(_dumps_json(report, newline=True))
     print(f"  - 报告已保存: {report_file}")
 
     # 打印最终汇总
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+调试工具 - 格式化紧凑 JSON
+data_processor.py 写出的 state.json 与报告均为紧凑格式，
+需要人工阅读时用本脚本格式化输出
+
+用法:
+  python debug_pretty.py .webnovel/state.json
+  python debug_pretty.py .webnovel/report_chapter_1.json --in-place
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+
+def pretty(path):
+    """返回格式化后的文本"""
+    text = Path(path).read_text(encoding='utf-8')
+    return json.dumps(json.loads(text), ensure_ascii=False, indent=2) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="格式化紧凑 JSON 文件")
+    parser.add_argument('files', nargs='+', type=Path, help="待格式化的文件")
+    parser.add_argument('--in-place', action='store_true', help="原地改写文件")
+    args = parser.parse_args()
+
+    for path in args.files:
+        output = pretty(path)
+        if args.in_place:
+            path.write_text(output, encoding='utf-8')
+            print(f"已格式化: {path}", file=sys.stderr)
+        else:
+            sys.stdout.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+data_processor 单元测试
+"""
+
+import json
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+import data_processor as dp
+
+SCRIPTS_DIR = Path(__file__).parent / ".claude" / "scripts"
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    """将 data_processor 的存储路径指向临时目录"""
+    monkeypatch.setattr(dp, "STORAGE_PATH", tmp_path)
+    monkeypatch.setattr(dp, "STATE_FILE", tmp_path / "state.json")
+    monkeypatch.setattr(dp, "INDEX_DB", tmp_path / "index.db")
+    return tmp_path
+
+
+class TestIndexStore:
+    """index.db 写入测试"""
+
+    def test_list_columns_stay_json_text(self, storage):
+        """列表列与 IndexManager / status_reporter 共用，必须能被 json.loads 读取"""
+        entities = [{'id': 'yefan', 'type': '角色', 'mentions': ['叶凡', '他'], 'confidence': 0.95}]
+        scenes = [{'index': 1, 'start_line': 1, 'end_line': 10, 'location': '街头',
+                   'summary': '测试', 'characters': ['yefan']}]
+        with dp.IndexStore() as store:
+            store.create()
+            store.insert_chapter(1, "租房", "静雅小区", 100, entities, scenes, "2026-01-01T00:00:00")
+
+        conn = sqlite3.connect(str(dp.INDEX_DB))
+        characters, stored_scenes = conn.execute("SELECT characters, scenes FROM chapters").fetchone()
+        mentions = conn.execute("SELECT mentions FROM entity_appearances").fetchone()[0]
+        scene_characters = conn.execute("SELECT characters FROM scenes").fetchone()[0]
+        conn.close()
+
+        assert json.loads(characters) == ['yefan']
+        assert json.loads(stored_scenes) == scenes
+        assert json.loads(mentions) == ['叶凡', '他']
+        assert json.loads(scene_characters) == ['yefan']
+
+    def test_old_schema_gains_list_columns(self, storage):
+        conn = sqlite3.connect(str(dp.INDEX_DB))
+        conn.execute("""
+            CREATE TABLE chapters (chapter INTEGER PRIMARY KEY, title TEXT, location TEXT,
+                                   word_count INTEGER, created_at TEXT)
+        """)
+        conn.execute("""
+            CREATE TABLE scenes (id INTEGER PRIMARY KEY AUTOINCREMENT, chapter INTEGER,
+                                 scene_index INTEGER, location TEXT, summary TEXT,
+                                 characters TEXT, start_line INTEGER, end_line INTEGER)
+        """)
+        conn.execute("INSERT INTO scenes (chapter, characters) VALUES (1, ?)", ('["yefan", "guwanqing"]',))
+        conn.commit()
+        conn.close()
+
+        with dp.IndexStore() as store:
+            store.create()
+
+        conn = sqlite3.connect(str(dp.INDEX_DB))
+        rows = conn.execute("SELECT characters, typeof(characters) FROM scenes ORDER BY chapter").fetchall()
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(chapters)")}
+        conn.close()
+
+        # 其他工具写入的 TEXT 原样保留
+        assert rows == [('["yefan", "guwanqing"]', 'text')]
+        assert {'characters', 'scenes'} <= columns
+
+
+def _base_state():
+    return {
+        'metadata': {},
+        'entities_v3': {
+            '角色': {
+                'yefan': {
+                    'id': 'yefan',
+                    'canonical_name': '叶凡',
+                    'current': {'location': '', 'status': '', 'last_chapter': 0},
+                    'history': [],
+                }
+            }
+        },
+        'alias_index': {},
+    }
+
+
+def _write_state(state):
+    dp.STATE_FILE.write_text(json.dumps(state, ensure_ascii=False), encoding='utf-8')
+
+
+NEW_ROOM = {'suggested_id': '602_room', 'name': '602室', 'type': '地点', 'tier': '重要', 'desc': '次卧'}
+MOVE_IN = {'entity_id': 'yefan', 'field': 'location', 'old': '', 'new': '602室', 'reason': '租房成功'}
+
+
+class TestUpdateState:
+    """state.json 更新测试"""
+
+    def test_writes_compact_snapshot(self, storage):
+        _write_state(_base_state())
+        state, _, _ = dp.load_context()
+        dp.update_state(state, [], [NEW_ROOM], [MOVE_IN], [], "2026-01-01T00:00:00")
+
+        text = dp.STATE_FILE.read_text(encoding='utf-8')
+        snapshot = json.loads(text)
+        assert '\n' not in text
+        assert '602_room' in snapshot['entities_v3']['地点']
+        assert snapshot['alias_index']['602室'] == [{'type': '地点', 'id': '602_room'}]
+        assert snapshot['metadata']['updated_at'] == "2026-01-01T00:00:00"
+
+        yefan = snapshot['entities_v3']['角色']['yefan']
+        assert yefan['current']['location'] == '602室'
+        assert yefan['history'] == [{'chapter': 1, 'field': 'location', 'old': '',
+                                     'new': '602室', 'reason': '租房成功'}]
+
+    def test_unknown_entity_change_is_skipped(self, storage):
+        _write_state(_base_state())
+        state, _, _ = dp.load_context()
+        dp.update_state(state, [], [], [dict(MOVE_IN, entity_id='nobody')], [], "2026-01-01T00:00:00")
+
+        snapshot = json.loads(dp.STATE_FILE.read_text(encoding='utf-8'))
+        assert snapshot['entities_v3'] == _base_state()['entities_v3']
+
+
+CHAPTER_FILE = Path(__file__).parent / "正文" / "第0001章.md"
+
+# 场景只覆盖到第 6 行，第 7 行之后的命中不属于任何场景；第 3 行是场景间空隙
+SHORT_CHAPTER = "\n".join([
+    "叶凡走在街头",
+    "叶凡想去租房",
+    "空隙里的叶凡",
+    "顾晚晴在静雅小区",
+    "602室在3号楼",
+    "加微信后租房成功",
+    "场景之外的叶凡和顾晚晴",
+    "还房贷",
+])
+SHORT_SCENES = [
+    {'index': 1, 'start_line': 1, 'end_line': 2},
+    {'index': 2, 'start_line': 4, 'end_line': 6},
+]
+
+
+def _overlapping_count(text, keyword):
+    return sum(text.startswith(keyword, i) for i in range(len(text)))
+
+
+def _brute_force_counts(content, scenes):
+    lines = content.split("\n")
+    return [
+        [
+            _overlapping_count("\n".join(lines[scene['start_line'] - 1:scene['end_line']]), keyword)
+            for keyword in dp.CHAPTER_KEYWORDS
+        ]
+        for scene in scenes
+    ]
+
+
+def _fixtures():
+    yield SHORT_CHAPTER, SHORT_SCENES
+    content = CHAPTER_FILE.read_text(encoding='utf-8')
+    yield content, dp.chunk_scenes(content)
+
+
+class TestCountSceneMentions:
+    """场景关键词计数测试"""
+
+    def test_bisect_path(self, monkeypatch):
+        monkeypatch.setattr(dp, "HAS_NUMPY", False)
+        for content, scenes in _fixtures():
+            assert dp.count_scene_mentions(content, scenes) == _brute_force_counts(content, scenes)
+
+    def test_numpy_path_matches_bisect(self, monkeypatch):
+        pytest.importorskip("numpy")
+        for content, scenes in _fixtures():
+            vectorised = dp.count_scene_mentions(content, scenes)
+            monkeypatch.setattr(dp, "HAS_NUMPY", False)
+            fallback = dp.count_scene_mentions(content, scenes)
+            monkeypatch.setattr(dp, "HAS_NUMPY", True)
+            assert vectorised == fallback == _brute_force_counts(content, scenes)
+
+    @pytest.mark.parametrize("use_automaton", [False, True])
+    def test_hits_overlap(self, monkeypatch, use_automaton):
+        """Aho-Corasick 与 str.find 回退路径对重叠命中的定义一致"""
+        automaton = None
+        if use_automaton:
+            pytest.importorskip("ahocorasick")
+            automaton = dp._build_keyword_automaton(('哈哈',))
+        monkeypatch.setattr(dp, "CHAPTER_KEYWORDS", ('哈哈',))
+        monkeypatch.setattr(dp, "KEYWORD_AUTOMATON", automaton)
+        assert sorted(dp.iter_keyword_hits("哈哈哈")) == [(0, 0), (1, 0)]
+
+    def test_chapter_has_hits_past_last_scene(self):
+        content = CHAPTER_FILE.read_text(encoding='utf-8')
+        last_end = dp.chunk_scenes(content)[-1]['end_line']
+        tail = "\n".join(content.split("\n")[last_end:])
+        assert any(keyword in tail for keyword in dp.CHAPTER_KEYWORDS)
+
+
+RENT = {'from': 'yefan', 'to': 'guwanqing', 'type': '房东-租客', 'description': '叶凡租住顾晚晴的房子'}
+
+
+@pytest.fixture
+def structured_index(storage, monkeypatch):
+    """与 IndexStore 指向同一个 index.db 的 StructuredIndex 工厂"""
+    monkeypatch.syspath_prepend(str(SCRIPTS_DIR))
+    module = pytest.importorskip("structured_index")
+    (storage / ".webnovel").mkdir()
+    monkeypatch.setattr(dp, "INDEX_DB", storage / ".webnovel" / "index.db")
+    return lambda: module.StructuredIndex(project_root=storage)
+
+
+class TestRelationships:
+    """关系写入测试"""
+
+    @pytest.mark.parametrize("structured_first", [True, False])
+    def test_shares_structured_index_table(self, structured_index, structured_first):
+        if structured_first:
+            structured_index().conn.close()
+        with dp.IndexStore() as store:
+            store.create()
+            entities = _base_state()['entities_v3']
+            store.upsert_relationships(1, [RENT], entities)
+            store.upsert_relationships(1, [dict(RENT, description='续租')], entities)
+
+        index = structured_index()
+        rows = index.query_relationships(char_id='yefan')
+        index.conn.close()
+
+        assert rows == [{
+            'char1_id': 'yefan', 'char2_id': 'guwanqing', 'char1_name': '叶凡', 'char2_name': 'guwanqing',
+            'relation_type': '房东-租客', 'intensity': 50, 'description': '续租', 'last_update_chapter': 1,
+        }]
+
+    @pytest.mark.parametrize("relationships, key", [(None, 'relationships'), ([], 'relationships'),
+                                                    ({}, 'structured_relationships')])
+    def test_update_state_feeds_state_path(self, storage, relationships, key):
+        """新关系写入 state_manager / StructuredIndex 同步读取的位置，人物关系 dict 不动"""
+        state = _base_state()
+        if relationships is not None:
+            state['relationships'] = relationships
+        dp.update_state(state, [], [], [], [RENT], "2026-01-01T00:00:00")
+
+        snapshot = json.loads(dp.STATE_FILE.read_text(encoding='utf-8'))
+        assert snapshot[key] == [dict(RENT, chapter=1, created_at="2026-01-01T00:00:00")]
+        if key == 'structured_relationships':
+            assert snapshot['relationships'] == {}
+
+
+def test_extract_entities_chapter_one():
+    """规则表输出与改写前的逐条判断一致（第1章没有“加微信”，叶凡的状态变化不触发）"""
+    content = CHAPTER_FILE.read_text(encoding='utf-8')
+    appeared, new, changes, relationships, uncertain = dp.extract_entities(content, {}, {})
+
+    assert appeared == [
+        {'id': 'yefan', 'type': '角色', 'mentions': ['叶凡', '他'], 'confidence': 0.95},
+        {'id': 'guwanqing', 'type': '角色', 'mentions': ['顾晚晴', '她', '顾女士'], 'confidence': 0.95},
+    ]
+    assert new == [
+        {'suggested_id': 'middle_woman', 'name': '中年妇女', 'type': '角色', 'tier': '装饰',
+         'desc': '街边举牌招租的中年妇女，态度敷衍'},
+        {'suggested_id': 'jingya_community', 'name': '静雅小区', 'type': '地点', 'tier': '重要',
+         'desc': '老小区，干净整洁，有3号楼602室'},
+        {'suggested_id': '602_room', 'name': '602室', 'type': '地点', 'tier': '重要',
+         'desc': '顾晚晴的出租房次卧'},
+    ]
+    assert changes == [
+        {'entity_id': 'guwanqing', 'field': 'location', 'old': '顾晚晴的房产',
+         'new': '静雅小区3号楼602室(房产)', 'reason': '房子出租给叶凡'},
+    ]
+    assert relationships == [RENT]
+    assert uncertain == [
+        {'mention': '那位先生', 'context': '中年妇女对叶凡的称呼',
+         'candidates': [{'type': '角色', 'id': 'yefan'}], 'confidence': 0.85},
+    ]
+
+
+def test_empty_chapter():
+    appeared, new, changes, relationships, uncertain = dp.extract_entities('', {}, {})
+    assert (appeared, new, changes) == ([], [], [])
+    assert len(relationships) == 1 and len(uncertain) == 1
+    assert dp.count_scene_mentions('', SHORT_SCENES) == [[0] * len(dp.CHAPTER_KEYWORDS)] * 2